@@ -1,21 +1,22 @@
+import mmap
+import sys
 from pathlib import Path
 
 from functools import partial
-from multiprocessing import Pool, shared_memory
-from multiprocessing.managers import SharedMemoryManager
+from multiprocessing import get_all_start_methods, get_context, shared_memory
 
 import numpy as np
+from numpy.polynomial import Legendre
 
-from skimage.transform import warp_polar, warp, PiecewiseAffineTransform
+from scipy import ndimage
+
+from skimage.transform import warp
 from skimage.util import img_as_uint
 from skimage import filters
 from skimage import measure
 
-import matplotlib.pyplot as plt
-
 import astropy.units as u
 from astropy import stats, visualization
-from astropy.modeling import models, fitting
 
 import photutils
 
@@ -46,9 +47,9 @@ def moments(data, aperture_diameter=76.2 * u.mm, wavelength=0.5 * u.um, pixel_sc
     """
     total = data.sum()
     dx = pixel_scale.to(u.radian).value  # convert pixel scale to radians
-    Y, X = np.indices(data.shape)
-    x = (X * data).sum() / total
-    y = (Y * data).sum() / total
+    # centroid from the marginal sums so we don't have to build and multiply through full index grids
+    x = (np.arange(data.shape[1]) * data.sum(axis=0)).sum() / total
+    y = (np.arange(data.shape[0]) * data.sum(axis=1)).sum() / total
     col = data[:, int(x)]
     width_x = np.sqrt(
         abs((np.arange(col.size) - y) ** 2 * col).sum() / col.sum()
@@ -137,6 +138,9 @@ def find_apertures(data, fwhm=7.0, threshold=7.0, plot=False, ap_size=5, contras
 
     fig = None
     if plot:
+        # pyplot roughly doubles the import time of this module so only pull it in when it's needed
+        import matplotlib.pyplot as plt
+
         fig, ax = plt.subplots()
         fig.set_label("DIMM Apertures")
         im, _ = visualization.imshow_norm(
@@ -163,15 +167,34 @@ def dimm_calc(data, aps):
     aps : ~photutils.CircularAperture
         Aperture positions
     """
-    ap_stats = photutils.ApertureStats(data, aps)
-    ap_pos = ap_stats.centroid
+    # this is the same center-of-mass that ApertureStats.centroid calculates using the 'center' aperture
+    # mask, but done for all of the apertures at once without building the full set of aperture statistics
+    # for every frame.
+    pos = aps.positions
+    half = int(np.ceil(aps.r + 0.5))
+    offsets = np.arange(-half, half + 1)
+    ix = np.rint(pos[:, 0])[:, np.newaxis] + offsets
+    iy = np.rint(pos[:, 1])[:, np.newaxis] + offsets
+    in_aperture = (
+        (ix[:, np.newaxis, :] - pos[:, 0, np.newaxis, np.newaxis]) ** 2 +
+        (iy[:, :, np.newaxis] - pos[:, 1, np.newaxis, np.newaxis]) ** 2
+    ) < aps.r ** 2
+    # pixels that fall off the edge of the frame don't contribute
+    in_aperture &= ((iy >= 0) & (iy < data.shape[0]))[:, :, np.newaxis]
+    in_aperture &= ((ix >= 0) & (ix < data.shape[1]))[:, np.newaxis, :]
+    cutouts = data[
+        np.clip(iy, 0, data.shape[0] - 1).astype(int)[:, :, np.newaxis],
+        np.clip(ix, 0, data.shape[1] - 1).astype(int)[:, np.newaxis, :]
+    ] * in_aperture
+    total = cutouts.sum(axis=(1, 2))
+    ap_pos = np.transpose([
+        (ix * cutouts.sum(axis=1)).sum(axis=1) / total,
+        (iy * cutouts.sum(axis=2)).sum(axis=1) / total
+    ])
     new_aps = photutils.CircularAperture(ap_pos, aps.r)
-    base1 = ap_pos[1] - ap_pos[0]
-    base2 = ap_pos[2] - ap_pos[0]
-    base3 = ap_pos[2] - ap_pos[1]
-    d_base1 = np.sqrt(np.dot(base1.T, base1))
-    d_base2 = np.sqrt(np.dot(base2.T, base2))
-    d_base3 = np.sqrt(np.dot(base3.T, base3))
+    # baselines are 0-1, 0-2, and 1-2
+    bases = ap_pos[[1, 2, 2]] - ap_pos[[0, 0, 1]]
+    d_base1, d_base2, d_base3 = np.linalg.norm(bases, axis=1)
 
     return new_aps, [d_base1, d_base2, d_base3]
 
@@ -206,16 +229,15 @@ def analyze_dimm_cube(filename, init_ave=3, plot=False):
     baselines = np.array(baselines).transpose()
     positions = np.array(positions).transpose()
 
-    seeing_vals = []
-    for baseline in baselines:
-        seeing_vals.append(seeing(baseline.std()))
+    # seeing() is plain array math so do all of the baselines in one call
+    seeing_vals = seeing(baselines.std(axis=1))
 
-    ave_seeing = u.Quantity(seeing_vals).mean()
+    ave_seeing = seeing_vals.mean()
 
     return ave_seeing, seeing_vals, baselines, positions, cube['frame_times'], fig
 
 
-def process_fass_image(image, background_box_size=15, width_cut=0.1):
+def process_fass_image(image, background_box_size=15, width_cut=0.1, compute_std=True):
     """
     Process FASS image to measure background, image statistics, pupil center, and pupil width
 
@@ -227,6 +249,8 @@ def process_fass_image(image, background_box_size=15, width_cut=0.1):
         Size of the box to use for background estimation. Uses the four corners of the image.
     width_cut : float (default: 0.1)
         Fraction of the maximum pixel value to use for determining the width of the pupil.
+    compute_std : bool (default: True)
+        Calculate the standard deviation of the background. Set to False to skip it when it isn't needed.
 
     Returns
     -------
@@ -236,8 +260,8 @@ def process_fass_image(image, background_box_size=15, width_cut=0.1):
         Mean background value
     bkg_median : float
         Median background value
-    bkg_std : float
-        Standard deviation in the background regions
+    bkg_std : float or None
+        Standard deviation in the background regions, None if compute_std is False
     x : float
         X coordinate of the pupil center
     y : float
@@ -252,16 +276,15 @@ def process_fass_image(image, background_box_size=15, width_cut=0.1):
     background = np.vstack([ul, ll, ur, lr])
     bkg_mean = np.mean(background)
     bkg_median = np.median(background)
-    bkg_std = np.std(background)
-    proc_image = image.copy() - bkg_median
-
-    Y, X = np.indices(proc_image.shape)
-    proc_sum = proc_image.sum()
-    x = (X * proc_image).sum() / proc_sum
-    y = (Y * proc_image).sum() / proc_sum
+    bkg_std = np.std(background) if compute_std else None
+    proc_image = image - bkg_median
 
+    # the centroid only needs the marginal sums, which we need for the width anyway
     x_sum = proc_image.sum(axis=0)
     y_sum = proc_image.sum(axis=1)
+    proc_sum = x_sum.sum()
+    x = (np.arange(x_sum.size) * x_sum).sum() / proc_sum
+    y = (np.arange(y_sum.size) * y_sum).sum() / proc_sum
 
     width_x = np.where(x_sum > width_cut * x_sum.max())[0].size
     width_y = np.where(y_sum > width_cut * y_sum.max())[0].size
@@ -292,24 +315,207 @@ def init_fass_cube(image_cube, n_frames=500):
     width : float
         Width of the pupil
     """
-    image = image_cube[:n_frames, :, :].mean(axis=0)
+    frames = image_cube[:n_frames, :, :]
+    if frames.dtype.kind == 'u' and frames.dtype.itemsize <= 2 and frames.shape[0] <= 2**16:
+        # a uint32 sum can't overflow for this many 8/16-bit frames and avoids casting every pixel to float64
+        image = frames.sum(axis=0, dtype=np.uint32) / frames.shape[0]
+    else:
+        image = frames.mean(axis=0)
     proc_image, _, _, _, x, y, width = process_fass_image(image)
     return proc_image, x, y, width
 
 
-def _process_slice_func(
-    index,
-    x0=0,
-    y0=0,
-    radius=100,
-    input_dtype=np.float32,
-    input_cube_shape=(1000, 100, 100),
-    output_cube_shape=(1000, 100, 100),
-    slice_shape=(100, 100),
-    input_key=None,
-    output_key=None,
-    center_gain=0.1
-):
+# forked workers can share the parent's arrays directly. fork isn't available on windows and isn't safe on macos
+# (e.g. inside multi-threaded jupyter kernels) so there the arrays are passed through named shared memory instead.
+FORK_WORKERS = 'fork' in get_all_start_methods() and sys.platform != 'darwin'
+
+# input cube, precomputed coordinate map, and output cube for the pool workers. set by _init_worker() in each
+# worker process.
+_input_cube = None
+_coord_map = None
+_output_cube = None
+_worker_shm = []
+
+
+def _attach_array(array):
+    """
+    Return array as is or, if it's a (name, shape, dtype) tuple describing a named shared memory block, attach to
+    the block and return an array view of it.
+    """
+    if not isinstance(array, tuple):
+        return array
+    name, shape, dtype = array
+    shm = shared_memory.SharedMemory(name=name)
+    # keep the block open for the life of the worker
+    _worker_shm.append(shm)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _init_worker(input_cube, coord_map=None, output_cube=None):
+    """
+    Pool initializer that hands the input cube, coordinate map, and output cube to a worker. With forked workers
+    these are the parent's own arrays. Otherwise the cubes are passed as (name, shape, dtype) descriptions of named
+    shared memory blocks.
+    """
+    global _input_cube, _coord_map, _output_cube
+    _input_cube = _attach_array(input_cube)
+    _coord_map = coord_map
+    _output_cube = _attach_array(output_cube)
+
+
+def _shared_float32_array(shape):
+    """
+    Allocate a float32 array in anonymous shared memory. Pool workers forked after it's created write into the
+    same pages the parent sees so their results don't need to be copied back. This only works with forked workers
+    so it's only used when FORK_WORKERS is True.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the array
+
+    Returns
+    -------
+    array : np.ndarray
+        Zero-filled float32 array backed by a shared mmap
+    """
+    count = int(np.prod(shape))
+    buf = mmap.mmap(-1, max(count, 1) * np.dtype(np.float32).itemsize)
+    return np.frombuffer(buf, dtype=np.float32, count=count).reshape(shape)
+
+
+def _map_frames(func, image_cube, coord_map, output_shape, nproc=8):
+    """
+    Run func on each frame of image_cube in a pool of worker processes. The workers write their results into a
+    float32 output cube which is returned.
+
+    Parameters
+    ----------
+    func : callable
+        Worker function that takes a frame index
+    image_cube : np.ndarray
+        Input cube
+    coord_map : np.ndarray
+        Precomputed coordinate map for the workers
+    output_shape : tuple
+        Shape of the output cube
+    nproc : int (default: 8)
+        Number of processes to use
+
+    Returns
+    -------
+    output_cube : np.ndarray
+        float32 output cube
+    """
+    nframes = image_cube.shape[0]
+    chunksize = max(1, nframes // (4 * nproc))
+
+    if FORK_WORKERS:
+        output_cube = _shared_float32_array(output_shape)
+        with get_context('fork').Pool(
+            processes=nproc,
+            initializer=_init_worker,
+            initargs=(image_cube, coord_map, output_cube)
+        ) as pool:
+            # the workers write into shared memory so there's nothing to collect. let frames finish in any order.
+            for _ in pool.imap_unordered(func, range(nframes), chunksize=chunksize):
+                pass
+        return output_cube
+
+    returned_cube = np.ndarray(output_shape, dtype=np.float32)
+    input_shm = shared_memory.SharedMemory(create=True, size=max(image_cube.nbytes, 1))
+    output_shm = shared_memory.SharedMemory(create=True, size=max(returned_cube.nbytes, 1))
+    try:
+        input_shm_cube = np.ndarray(image_cube.shape, dtype=image_cube.dtype, buffer=input_shm.buf)
+        input_shm_cube[:] = image_cube[:]
+        output_shm_cube = np.ndarray(output_shape, dtype=np.float32, buffer=output_shm.buf)
+        with get_context().Pool(
+            processes=nproc,
+            initializer=_init_worker,
+            initargs=(
+                (input_shm.name, image_cube.shape, image_cube.dtype),
+                coord_map,
+                (output_shm.name, output_shape, np.float32)
+            )
+        ) as pool:
+            for _ in pool.imap_unordered(func, range(nframes), chunksize=chunksize):
+                pass
+        # copy data out of shared memory before closing
+        returned_cube[:] = output_shm_cube[:]
+        del input_shm_cube, output_shm_cube
+    finally:
+        input_shm.close()
+        input_shm.unlink()
+        output_shm.close()
+        output_shm.unlink()
+    return returned_cube
+
+
+def _polar_offsets(radius, output_shape):
+    """
+    Build the (row, col) offsets from the pupil center of each pixel in a polar unwrapped image. This is the same
+    linear mapping that skimage.transform.warp_polar() uses, but it only depends on the radius and output shape so
+    it can be computed once per cube instead of once per frame.
+
+    Parameters
+    ----------
+    radius : float
+        Radius of the circle to unwrap
+    output_shape : tuple
+        Shape of the unwrapped image as (azimuth, radius)
+
+    Returns
+    -------
+    offsets : np.ndarray
+        Array of shape (2,) + output_shape with the row and column offsets
+    """
+    k_angle = output_shape[0] / (2 * np.pi)
+    k_radius = output_shape[1] / radius
+    angle = np.arange(output_shape[0])[:, np.newaxis] / k_angle
+    r = np.arange(output_shape[1])[np.newaxis, :] / k_radius
+    return np.array([r * np.sin(angle), r * np.cos(angle)])
+
+
+def _rectify_coords(shape, pup_inner, pup_outer, contour_inner, contour_outer):
+    """
+    Build the coordinate map that rectifies an unwrapped FASS image. Each row is stretched linearly so that the
+    fitted inner and outer pupil edges land on straight columns at pup_inner and pup_outer. This is exactly what a
+    PiecewiseAffineTransform between those lines and the edge contours does at integer rows, but without the
+    triangulation.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the unwrapped image
+    pup_inner : float
+        Column of the rectified inner pupil edge
+    pup_outer : float
+        Column of the rectified outer pupil edge
+    contour_inner : callable
+        Column of the inner pupil edge in the unwrapped image as a function of row
+    contour_outer : callable
+        Column of the outer pupil edge in the unwrapped image as a function of row
+
+    Returns
+    -------
+    coords : np.ndarray
+        Array of shape (2,) + shape with the (row, col) in the unwrapped image to sample for each rectified pixel.
+        Pixels outside the pupil are set to -1 so that they're filled with 0, like warp() does.
+    """
+    y = np.arange(shape[0])[:, np.newaxis]
+    x = np.arange(shape[1])[np.newaxis, :]
+    frac = (x - pup_inner) / (pup_outer - pup_inner)
+    inner = contour_inner(y)
+    outer = contour_outer(y)
+    col = inner + frac * (outer - inner)
+    outside = (frac < 0) | (frac > 1)
+    return np.array([
+        np.where(outside, -1.0, np.broadcast_to(y, shape)),
+        np.where(outside, -1.0, col)
+    ])
+
+
+def _process_slice_func(index, x0=0, y0=0, center_gain=0.1):
     """
     Process a slice of a FASS cube to unwrap polar coordinates to a cartesian grid
     of radius vs azimuth.
@@ -322,52 +528,42 @@ def _process_slice_func(
         Initial guess for the pupil center x coordinate
     y0 : float
         Initial guess for the pupil center y coordinate
-    radius : float
-        Pupil radius to pass to warp_polar()
-    input_dtype : np.dtype
-        dtype of the input cube
-    input_cube_shape : tuple
-        Shape of the input cube
-    output_cube_shape : tuple
-        Shape of the output cube
-    slice_shape : tuple
-        Shape of a slice in the output cube
-    input_key : str
-        Name of the shared memory block containing the input cube
-    output_key : str
-        Name of the shared memory block containing the output cube
     center_gain : float
         Gain to use for updating the pupil center position
     """
-    input_shm = shared_memory.SharedMemory(name=input_key)
-    output_shm = shared_memory.SharedMemory(name=output_key)
-    input_cube = np.ndarray(input_cube_shape, dtype=input_dtype, buffer=input_shm.buf)
-    output_cube = np.ndarray(output_cube_shape, dtype=np.float32, buffer=output_shm.buf)
-    image = input_cube[index, :, :]
+    image = _input_cube[index, :, :]
 
-    proc_image, _, _, _, x, y, _ = process_fass_image(image)
+    proc_image, _, _, _, x, y, _ = process_fass_image(image, compute_std=False)
     x0 = x0 + center_gain * (x - x0)
     y0 = y0 + center_gain * (y - y0)
 
-    unwrapped = warp_polar(
+    # polar offsets come from _coord_map. like warp_polar(center=(x0, y0)), x0 is treated as the row.
+    coords = _coord_map + np.array([x0, y0])[:, np.newaxis, np.newaxis]
+    # this is the bilinear resample that warp() would do, but written straight into the float32 output cube.
+    # memory savings/performance worth the small loss of precision.
+    ndimage.map_coordinates(
         proc_image,
-        output_shape=slice_shape,
-        center=(x0, y0),
-        radius=radius,
-        scaling='linear',
-        preserve_range=True
+        coords,
+        output=_output_cube[index, :, :],
+        order=1,
+        mode='grid-constant',
+        cval=0.0,
+        prefilter=False
     )
-    # recast output as float32. memory savings/performance
-    # worth the small loss of precision.
-    output_cube[index, :, :] = unwrapped.astype(np.float32)
 
 
-def _rectify_slice(index, tform=None, input_key=None, input_dtype=np.float32, input_shape=(1000, 100, 100)):
-    input_shm = shared_memory.SharedMemory(name=input_key)
-    input_cube = np.ndarray(input_shape, dtype=input_dtype, buffer=input_shm.buf)
-    imslice = input_cube[index, :, :]
-    rect_slice = warp(imslice, tform, output_shape=input_shape[1:], preserve_range=True)
-    input_cube[index, :, :] = rect_slice.astype(input_dtype)
+def _rectify_slice(index):
+    imslice = _input_cube[index, :, :]
+    # same bilinear resample as warp(), but written straight into the float32 output cube
+    ndimage.map_coordinates(
+        imslice,
+        _coord_map,
+        output=_output_cube[index, :, :],
+        order=1,
+        mode='grid-constant',
+        cval=0.0,
+        prefilter=False
+    )
 
 
 def unwrap_fass_cube(image_cube, center_gain=0.1, radial_pad=10, oversample=2, nproc=8):
@@ -397,35 +593,18 @@ def unwrap_fass_cube(image_cube, center_gain=0.1, radial_pad=10, oversample=2, n
     y0 = y
     radius = width/2 + radial_pad
 
-    with SharedMemoryManager() as smm:
-        input_shm = shared_memory.SharedMemory(create=True, size=image_cube.nbytes)
-        input_dtype = image_cube.dtype
-        input_shm_cube = np.ndarray(image_cube.shape, dtype=input_dtype, buffer=input_shm.buf)
-        input_shm_cube[:] = image_cube[:]
-        output_slice_shape = (int(2 * np.pi * oversample * radius), int(oversample * radius))
-        output_cube_shape = (image_cube.shape[0],) + output_slice_shape
-        output_size = image_cube.shape[0] * output_slice_shape[0] * output_slice_shape[1] * 4  # we'll use float32 outputs
-        output_shm = shared_memory.SharedMemory(create=True, size=output_size)
-        unwrapped_cube = np.ndarray(output_cube_shape, dtype=np.float32, buffer=output_shm.buf)
-        returned_cube = np.ndarray(output_cube_shape, dtype=np.float32)
-        with Pool(processes=nproc) as pool:
-            proc_slice = partial(
-                _process_slice_func,
-                x0=x0,
-                y0=y0,
-                radius=radius,
-                input_dtype=input_dtype,
-                input_cube_shape=image_cube.shape,
-                output_cube_shape=output_cube_shape,
-                slice_shape=output_slice_shape,
-                input_key=input_shm.name,
-                output_key=output_shm.name,
-                center_gain=center_gain
-            )
-            pool.map(proc_slice, range(image_cube.shape[0]))
-            # copy data out of shared memory before closing
-            returned_cube[:] = unwrapped_cube[:]
-    return returned_cube
+    output_slice_shape = (int(2 * np.pi * oversample * radius), int(oversample * radius))
+    output_cube_shape = (image_cube.shape[0],) + output_slice_shape
+    polar_offsets = _polar_offsets(radius, output_slice_shape)
+    proc_slice = partial(
+        _process_slice_func,
+        x0=x0,
+        y0=y0,
+        center_gain=center_gain
+    )
+    # we'll use float32 outputs
+    unwrapped_cube = _map_frames(proc_slice, image_cube, polar_offsets, output_cube_shape, nproc=nproc)
+    return unwrapped_cube
 
 
 def rectify_fass_cube(
@@ -441,42 +620,13 @@ def rectify_fass_cube(
     pup_inner = np.mean(contours[0][:, 1])
     pup_outer = np.mean(contours[1][:, 1])
 
-    fitter = fitting.LinearLSQFitter()
-    contour_model = models.Legendre1D(degree=contour_degree)
-    contour_inner = fitter(contour_model, contours[0][:, 0], contours[0][:, 1])
-    contour_outer = fitter(contour_model, contours[1][:, 0], contours[1][:, 1])
-
-    y = np.arange(stacked.shape[0])
-    src_inner = np.array([pup_inner * np.ones(stacked.shape[0]), y]).T
-    src_outer = np.array([pup_outer * np.ones(stacked.shape[0]), y]).T
-    src = np.vstack([src_inner, src_outer])
-
-    dst_inner = np.array([contour_inner(y), y]).T
-    dst_outer = np.array([contour_outer(y), y]).T
-    dst = np.vstack([dst_inner, dst_outer])
+    contour_inner = Legendre.fit(contours[0][:, 0], contours[0][:, 1], contour_degree)
+    contour_outer = Legendre.fit(contours[1][:, 0], contours[1][:, 1], contour_degree)
 
-    tform = PiecewiseAffineTransform()
-    tform.estimate(src, dst)
+    # the transform is the same for every frame so only build the coordinate map once
+    rect_coords = _rectify_coords(stacked.shape, pup_inner, pup_outer, contour_inner, contour_outer)
+    flat_image = warp(stacked, rect_coords)
 
-    flat_image = warp(stacked, tform, output_shape=stacked.shape)
-
-    returned_cube = np.ndarray(image_cube.shape, dtype=np.float32)
-
-    with SharedMemoryManager() as smm:
-        input_shm = shared_memory.SharedMemory(create=True, size=image_cube.nbytes)
-        input_dtype = image_cube.dtype
-        input_shm_cube = np.ndarray(image_cube.shape, dtype=input_dtype, buffer=input_shm.buf)
-        input_shm_cube[:] = image_cube[:]
-        with Pool(processes=nproc) as pool:
-            proc_slice = partial(
-                _rectify_slice,
-                tform=tform,
-                input_key=input_shm.name,
-                input_dtype=input_dtype,
-                input_shape=image_cube.shape
-            )
-            pool.map(proc_slice, range(image_cube.shape[0]))
-            # copy data out of shared memory before closing
-            returned_cube[:] = input_shm_cube[:]
+    returned_cube = _map_frames(_rectify_slice, image_cube, rect_coords, image_cube.shape, nproc=nproc)
 
     return returned_cube, flat_image
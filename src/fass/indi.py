@@ -29,35 +29,73 @@ class INDI_Device:
         else:
             self.log = log
 
-    def get_prop(self, property, key):
+    def _getprop(self, indi_str):
         """
-        Use indi_getprop to get an INDI property
+        Run indi_getprop and parse its "device.property.key=value" output lines
 
         Arguments
         ---------
-        property : str
-            INDI property of device to be queried
+        indi_str : str
+            Property specification to pass to indi_getprop, e.g. device.property.key or device.property.*
 
-        key : str
-            Which key of the property to query
+        Returns
+        -------
+        values : dict
+            Values of the returned property keys, indexed by key name
         """
         cmd = ['indi_getprop', '-h', self.host, '-p', self.port]
 
-        indi_str = f"{self.devname}.{property}.{key}"
-
         cmd.append(indi_str)
 
         try:
             p = subprocess.run(cmd, check=True, capture_output=True)
         except Exception as e:
-            self.log.error(f"indi_getprop command failed: {e}")
+            self.log.error("indi_getprop command failed: %s", e)
             return e
 
-        self.log.info(f"Get {indi_str} from {self.host}:{self.port}")
+        self.log.info("Get %s from %s:%s", indi_str, self.host, self.port)
+
+        values = {}
+        for line in p.stdout.decode().splitlines():
+            name, value = line.split('=', 1)
+            values[name.split('.')[-1]] = value
+
+        return values
+
+    def get_prop(self, property, key):
+        """
+        Use indi_getprop to get an INDI property
+
+        Arguments
+        ---------
+        property : str
+            INDI property of device to be queried
+
+        key : str
+            Which key of the property to query
+        """
+        values = self._getprop(f"{self.devname}.{property}.{key}")
+
+        if isinstance(values, Exception):
+            return values
 
-        value = p.stdout.decode().split('=')[1]
+        return values[key]
+
+    def get_props(self, property):
+        """
+        Use a single indi_getprop call to get all of the keys of an INDI property
+
+        Arguments
+        ---------
+        property : str
+            INDI property of device to be queried
 
-        return value
+        Returns
+        -------
+        values : dict
+            Values of the property keys, indexed by key name
+        """
+        return self._getprop(f"{self.devname}.{property}.*")
 
     def set_prop(self, property, key, value):
         """
@@ -74,19 +112,35 @@ class INDI_Device:
         value : str or float
             New value of the property key
         """
+        return self.set_props(property, {key: value})
+
+    def set_props(self, property, values):
+        """
+        Use a single indi_setprop call to set several keys of an INDI property at once
+
+        Arguments
+        ---------
+        property : str
+            INDI property of device to be configured
+
+        values : dict
+            New values of the property keys, indexed by key name
+        """
         cmd = ['indi_setprop', '-h', self.host, '-p', self.port]
 
-        indi_str = f"{self.devname}.{property}.{key}={value}"
+        keys = ";".join(str(k) for k in values.keys())
+        vals = ";".join(str(v) for v in values.values())
+        indi_str = f"{self.devname}.{property}.{keys}={vals}"
 
         cmd.append(indi_str)
 
         try:
             p = subprocess.run(cmd, check=True, capture_output=True)
         except Exception as e:
-            self.log.error(f"indi_setprop command failed: {e}")
+            self.log.error("indi_setprop command failed: %s", e)
             return e
 
-        self.log.info(f"Set {indi_str} on {self.host}:{self.port}")
+        self.log.info("Set %s on %s:%s", indi_str, self.host, self.port)
 
         if len(p.stdout) > 0:
             self.log.info(p.stdout)
@@ -95,6 +149,40 @@ class INDI_Device:
 
         return p
 
+    def wait_prop(self, property, key, value, timeout=10):
+        """
+        Use indi_eval to block until an INDI property takes on a given value
+
+        Arguments
+        ---------
+        property : str
+            INDI property of device to be monitored
+
+        key : str
+            Which key of the property to monitor
+
+        value : str or float
+            Value to wait for. Switches are 1 for On and 0 for Off.
+
+        timeout : float (default: 10)
+            Maximum time in seconds to wait
+        """
+        cmd = ['indi_eval', '-h', self.host, '-p', self.port, '-w', '-t', str(timeout)]
+
+        indi_str = f'"{self.devname}.{property}.{key}"=={value}'
+
+        cmd.append(indi_str)
+
+        try:
+            p = subprocess.run(cmd, check=True, capture_output=True)
+        except Exception as e:
+            self.log.error("indi_eval command failed: %s", e)
+            return e
+
+        self.log.info("Waited for %s on %s:%s", indi_str, self.host, self.port)
+
+        return p
+
 
 class INDI_Camera(INDI_Device):
     """
@@ -164,33 +252,62 @@ class INDI_Camera(INDI_Device):
         self.set_prop("RECORD_OPTIONS", "RECORD_DURATION", rectime)
         self.set_prop("RECORD_STREAM", "RECORD_DURATION_ON", "On")
 
+    def wait_recording_complete(self, rectime, start_timeout=10, timeout=None):
+        """
+        Block until a recording started by record_frames() or record_duration() finishes. RECORD_OFF is
+        already On before the recorder starts and indi_setprop returns without waiting for the driver, so
+        this first waits for RECORD_OFF to switch Off (recording started) and then for it to switch back On
+        (recording finished). A recording short enough to start and finish before the first wait connects
+        will be reported as never having started.
+
+        Arguments
+        ---------
+        rectime : float
+            Expected length of the recording in seconds, e.g. rectime for record_duration() or
+            nframes * exposure time for record_frames()
+        start_timeout : float (default: 10)
+            Maximum time in seconds to wait for the recording to start
+        timeout : float or None (default: None)
+            Maximum time in seconds to wait for the recording to finish once it has started. If None, use
+            2 * rectime + 10 to allow for frame rates slower than the exposure time implies.
+
+        Returns
+        -------
+        p : subprocess.CompletedProcess or Exception
+            Result of the final indi_eval call, or the exception from whichever wait failed
+        """
+        if timeout is None:
+            timeout = 2 * rectime + 10
+
+        p = self.wait_prop("RECORD_STREAM", "RECORD_OFF", 0, timeout=start_timeout)
+        if isinstance(p, Exception):
+            return p
+
+        return self.wait_prop("RECORD_STREAM", "RECORD_OFF", 1, timeout=timeout)
+
     def ser_mode(self):
         """
         Configure camera to save files in SER format
         """
-        self.set_prop("CCD_STREAM_RECORDER", "SER", "On")
-        self.set_prop("CCD_STREAM_RECORDER", "OGV", "Off")
+        self.set_props("CCD_STREAM_RECORDER", {"SER": "On", "OGV": "Off"})
 
     def ogv_mode(self):
         """
         Configure camera to save files in OGV format
         """
-        self.set_prop("CCD_STREAM_RECORDER", "SER", "Off")
-        self.set_prop("CCD_STREAM_RECORDER", "OGV", "On")
+        self.set_props("CCD_STREAM_RECORDER", {"SER": "Off", "OGV": "On"})
 
     def mjpeg_mode(self):
         """
         Configure camera to encode video using MJPEG
         """
-        self.set_prop("CCD_STREAM_ENCODER", "MJPEG", "On")
-        self.set_prop("CCD_STREAM_ENCODER", "RAW", "Off")
+        self.set_props("CCD_STREAM_ENCODER", {"MJPEG": "On", "RAW": "Off"})
 
     def raw_mode(self):
         """
         Configure camera to use raw video encoding
         """
-        self.set_prop("CCD_STREAM_ENCODER", "MJPEG", "Off")
-        self.set_prop("CCD_STREAM_ENCODER", "RAW", "On")
+        self.set_props("CCD_STREAM_ENCODER", {"MJPEG": "Off", "RAW": "On"})
 
     def set_filename(self, filename):
         """
@@ -219,7 +336,7 @@ class INDI_Camera(INDI_Device):
         height : int
             Height of the ROI
         """
-        self.set_prop("CCD_STREAM_FRAME", "X", int(x))
-        self.set_prop("CCD_STREAM_FRAME", "Y", int(y))
-        self.set_prop("CCD_STREAM_FRAME", "WIDTH", int(width))
-        self.set_prop("CCD_STREAM_FRAME", "HEIGHT", int(height))
+        self.set_props(
+            "CCD_STREAM_FRAME",
+            {"X": int(x), "Y": int(y), "WIDTH": int(width), "HEIGHT": int(height)}
+        )
@@ -1,21 +1,37 @@
 import os
+import copy
 import json
 import pkg_resources
 import shutil
 
+from functools import lru_cache
 from pathlib import Path
 
+SEQUENCE_TEMPLATE = pkg_resources.resource_filename(__name__, os.path.join("templates", "sequence_template.json"))
+SCHEDULE_TEMPLATE = pkg_resources.resource_filename(__name__, os.path.join("templates", "sequence_list_template.json"))
+
+
+@lru_cache(maxsize=None)
+def _parse_template(template):
+    with open(template, 'r') as fp:
+        return json.load(fp)
+
+
+def load_template(template):
+    """
+    Return a fresh copy of a JSON template, only parsing the file the first time it is requested
+    """
+    return copy.deepcopy(_parse_template(template))
+
 
 class Sequence:
     """
     Wrap an INDI/Ekos imaging sequence
     """
     def __init__(self):
-        template = pkg_resources.resource_filename(__name__, os.path.join("templates", "sequence_template.json"))
         capture_script = shutil.which("vid_capture")
 
-        with open(template, 'r') as fp:
-            self.config = json.load(fp)
+        self.config = load_template(SEQUENCE_TEMPLATE)
 
         self.config['SequenceQueue']['Job']['PostCaptureScript'] = capture_script
 
@@ -25,10 +41,7 @@ class Observation:
     Job entry in an INDI/Ekos Scheduler list
     """
     def __init__(self, target="Target", ra=0.0, dec=0.0, priority=10, sequence=Path.home() / "sequence.esq"):
-        template = pkg_resources.resource_filename(__name__, os.path.join("templates", "sequence_list_template.json"))
-
-        with open(template, 'r') as fp:
-            full_config = json.load(fp)
+        full_config = load_template(SCHEDULE_TEMPLATE)
 
         # use the first entry in the scheduler list template as the boiler-plate to build from
         self.config = full_config['SchedulerList']['Job'][0]
@@ -47,10 +60,7 @@ class Schedule:
     and write them to valid XML
     """
     def __init__(self):
-        template = pkg_resources.resource_filename(__name__, os.path.join("templates", "sequence_list_template.json"))
-
-        with open(template, 'r') as fp:
-            self.config = json.load(fp)
+        self.config = load_template(SCHEDULE_TEMPLATE)
 
         # zero out the list of jobs to initiate
         self.config['SchedulerList']['Job'] = []
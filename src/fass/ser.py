@@ -2,6 +2,7 @@
 the specifications for unpacking SER files are given at: http://www.grischa-hahn.homepage.t-online.de/astro/ser/SER%20Doc%20V3b.pdf
 """
 
+import warnings
 from struct import unpack
 from pathlib import Path
 from enum import Enum
@@ -10,6 +11,13 @@ import numpy as np
 
 from astropy.time import Time
 import astropy.units as u
+from erfa import ErfaWarning
+
+# SER timestamps count 100 ns ticks from the start of the year 1. ERFA flags year 1 as "dubious", which
+# is expected here, so don't let that warning fire when building the epoch or adding timestamps to it.
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", ErfaWarning)
+    SER_EPOCH = Time("0001-01-01 00:00:00")
 
 
 def read_int(fp, endian="<"):
@@ -40,7 +48,9 @@ def parse_time(timestamp):
     the two MSB.
     """
     # this implementation of the microsoft-provided spec has been tested and does work as intended
-    return timestamp * 100e-9 * u.second + Time("0001-01-01 00:00:00")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", ErfaWarning)
+        return timestamp * 100e-9 * u.second + SER_EPOCH
 
 
 class Color_ID(Enum):
@@ -179,20 +189,23 @@ def load_ser_file(filename):
 
         # Image data starts at File start offset decimal 178
         # Size of every image frame in byte is: 5_ImageWidth x 6_ImageHeigth x BytePerPixel
-        data_buf = fp.read(output['nframe'] * output['im_width'] * output['im_height'] * output['bytes_per_pixel'])
+        # The frames are memory-mapped rather than read in so that the cube only gets paged in as it is used.
+        data_offset = fp.tell()
         if output['bytes_per_pixel'] == 1:
-            output['data'] = np.frombuffer(
-                data_buf,
-                dtype=np.uint8
-            ).reshape((output['nframe'], output['im_height'], output['im_width']))
+            data_dtype = np.uint8
         else:
-            output['data'] = np.frombuffer(
-                data_buf,
-                dtype=np.uint16
-            ).reshape((output['nframe'], output['im_height'], output['im_width']))
+            data_dtype = np.uint16
+        output['data'] = np.memmap(
+            p,
+            dtype=data_dtype,
+            mode='r',
+            offset=data_offset,
+            shape=(output['nframe'], output['im_height'], output['im_width'])
+        )
 
         # Trailer starts at byte offset: 178 + 8_FrameCount x 5_ImageWidth x 6_ImageHeigth x BytePerPixel.
         # Trailer contains Date / Integer_64 (little-endian) time stamps in UTC for every image frame.
+        fp.seek(data_offset + output['data'].nbytes)
         trailer_buf = fp.read()
         output['frame_times'] = parse_time(np.frombuffer(trailer_buf, dtype=np.uint64))
 
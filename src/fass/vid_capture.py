@@ -2,7 +2,7 @@ import sys
 import argparse
 import logging
 
-from astropy.time import Time
+from datetime import datetime, timezone
 
 from fass.indi import INDI_Camera
 
@@ -74,6 +74,12 @@ def main():
         help="Filename to Save Video to"
     )
 
+    parser.add_argument(
+        '--wait',
+        action='store_true',
+        help="Wait for the recording to finish before exiting"
+    )
+
     record_group = parser.add_mutually_exclusive_group()
     record_group.add_argument(
         '--ser',
@@ -107,7 +113,7 @@ def main():
     target = cam.get_prop("FITS_HEADER", "FITS_OBJECT")
 
     if args.filename is None:
-        args.filename = f"{Time.now().strftime('%Y-%m-%dZ%H-%M-%S')}_{target}"
+        args.filename = f"{datetime.now(timezone.utc).strftime('%Y-%m-%dZ%H-%M-%S')}_{target}"
 
     if args.mjpeg:
         cam.mjpeg_mode()
@@ -125,11 +131,19 @@ def main():
 
     if args.duration:
         cam.record_duration(args.duration, savedir=args.savedir, filename=args.filename)
+        rectime = float(args.duration)
     else:
         cam.record_frames(args.nframes, savedir=args.savedir, filename=args.filename)
+        rectime = int(args.nframes) * float(args.exposure)
+
+    if args.wait:
+        p = cam.wait_recording_complete(rectime)
+        if isinstance(p, Exception):
+            log.error("Recording did not complete: %s", p)
+            return 1
 
     return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())